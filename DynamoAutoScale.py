@@ -1,12 +1,15 @@
 # Austin Oblouk - Oblouk.com
 # https://github.com/AustinOblouk/LambdaDynamoAutoScale
-# This is a simple automated DynamoDb provisioning script meant to be run inside of a Python 2.7 Lambda Function
+# This is a simple automated DynamoDb provisioning script meant to be run inside of a Python 3 Lambda Function
 # For setting up this simple script please see https://github.com/AustinOblouk/LambdaDynamoAutoScale
 
 import json
 import boto3
-import datetime
+import time
 import math
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 
 # If peak throughput is >= 90% of capacity, provisioned read/write capacity will be increased
 RAISE_CAPACITY_THRESHOLD = 0.90 
@@ -36,185 +39,281 @@ EMAIL_ADDRESSES_OF_RECIPIENTS = []
 # How many seconds of data per read/write throughput data point (MUST be a multiple of 60)
 SECONDS_PER_DATA_POINT = 300
 
+# Tables and indexes already at the minimum that cannot be lowered again today only check this many recent minutes for spikes
+# Older spikes would have raised them on an earlier run, so keep this longer than the Lambda schedule (1440 turns it off)
+MINIMUM_CAPACITY_LOOKBACK_MINUTES = 60
+
+# Warm invocations only fetch data points newer than the previous run, plus this many minutes again
+# because CloudWatch can publish DynamoDB data points a few minutes late
+METRIC_REFRESH_MINUTES = 15
+
+# The maximum number of tables to adjust at the same time
+MAXIMUM_CONCURRENT_TABLES = 16
+
+# GetMetricData accepts at most this many metric queries per call
+MAXIMUM_METRIC_QUERIES_PER_CALL = 500
+
+# CloudWatch metrics holding the consumed read/write capacity of tables and indexes
+READ_METRIC = 'ConsumedReadCapacityUnits'
+WRITE_METRIC = 'ConsumedWriteCapacityUnits'
+
+# Retry settings for all AWS calls, adaptive mode backs off client side when requests are throttled
+# The workers share each client, so its connection pool needs room for every worker's request to be in flight
+BOTO_CONFIG = Config(retries={'max_attempts': 10, 'mode': 'adaptive'}, max_pool_connections=MAXIMUM_CONCURRENT_TABLES)
+
+# Lambda ships log records to CloudWatch Logs, each record is one JSON object so Logs Insights can query its fields
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Clients are built once per Lambda container and reused by warm invocations, boto3 clients are thread safe
+# Building them here loads their service models during the Lambda init phase instead of the first invocation
+DYNAMODB_CLIENT = boto3.client('dynamodb', config=BOTO_CONFIG)
+CLOUDWATCH_CLIENT = boto3.client('cloudwatch', config=BOTO_CONFIG)
+# Most runs change nothing, so the SES client is only built by the first email sent from this container
+SES_CLIENT = None
+
+# Data points fetched by earlier invocations in this container, keyed like the peaks from getPeakThroughputs
+# Each entry is (start of the window it covers, time it was fetched, {timestamp: sum})
+METRIC_CACHE = {}
+
 
 def lambda_handler(event, context):
-    cloudwatch = boto3.client('cloudwatch')
-    dynamodbClient = boto3.client('dynamodb')
-    for table in dynamodbClient.list_tables()["TableNames"]:
-        adjustTableCapacity(str(table))
-        adjustTableIndexCapacities(str(table))
-
-def adjustTableCapacity(tableName):
-    dynamodb = boto3.resource('dynamodb').Table(tableName)
-    cloudwatch = boto3.client('cloudwatch')
-    
-    currentCapacity = dynamodb.provisioned_throughput
+    # Every table and index is measured over the same window, boto3 accepts epoch seconds as timestamps
+    now = time.time()
+    start = now - 86400
+    # ListTables returns at most 100 names per call, the paginator follows LastEvaluatedTableName for the rest
+    tableNames = [str(table) for page in DYNAMODB_CLIENT.get_paginator('list_tables').paginate() for table in page["TableNames"]]
+    notifications = []
+    try:
+        with ThreadPoolExecutor(max_workers=MAXIMUM_CONCURRENT_TABLES) as executor:
+            tables = []
+            for table in executor.map(lambda tableName: DYNAMODB_CLIENT.describe_table(TableName=tableName)["Table"], tableNames):
+                # On-demand tables have no provisioned capacity to manage, so they need no metrics or updates
+                if table.get("BillingModeSummary", {}).get("BillingMode") == "PAY_PER_REQUEST":
+                    logger.info(json.dumps({"table": table["TableName"], "message": "Skipping on-demand table"}))
+                else:
+                    tables.append(table)
+            peakThroughputs = getPeakThroughputs(tables, start, now)
+            # list() waits for every table and re-raises the first error from a worker
+            list(executor.map(lambda table: adjustTable(table, peakThroughputs, notifications), tables))
+    finally:
+        # One summary email per run, changes that were applied are still reported if another table failed
+        if len(notifications) > 0:
+            sendEmailNotification("Dynamo Capacity Updated For "+str(len(notifications))+" Tables/Indexes",
+                "Details:<br>"+"<br>".join(notifications))
+
+def getPeakThroughputs(tables, start, now):
+    # Fetches the consumed read/write capacity of every table and index with as few GetMetricData calls as possible
+    # Returns (peak throughput, minutes of data it covers) keyed by (tableName, indexName, metricName), indexName is None for tables
+    # The window is the last day, or MINIMUM_CAPACITY_LOOKBACK_MINUTES for tables and indexes settled at the minimum
+    recentStart = max(start, now - MINIMUM_CAPACITY_LOOKBACK_MINUTES*60)
+    # GetMetricData takes one StartTime per call so queries are grouped by the start of their window
+    queries = {}
+    queryKeys = {}
+    cache = {}
+    for table in tables:
+        tableName = table["TableName"]
+        # Dimensions are built once per table and index and shared by its read and write queries
+        tableDimension = {'Name': 'TableName', 'Value': tableName}
+        targets = [(None, [tableDimension], table["ProvisionedThroughput"])]
+        for secondaryIndex in table.get("GlobalSecondaryIndexes", []):
+            secondaryIndexName = secondaryIndex["IndexName"]
+            targets.append((secondaryIndexName, [tableDimension, {'Name': 'GlobalSecondaryIndexName', 'Value': secondaryIndexName}], secondaryIndex["ProvisionedThroughput"]))
+        for indexName, dimensions, currentCapacity in targets:
+            windowStart = recentStart if isSettledAtMinimum(currentCapacity) else start
+            for metricName in (READ_METRIC, WRITE_METRIC):
+                key = (tableName, indexName, metricName)
+                cachedStart, cachedAt, points = METRIC_CACHE.get(key, (None, None, {}))
+                if cachedStart is not None and cachedStart <= windowStart:
+                    # Cached points already cover the window up to the last run, only the rest is fetched
+                    queryStart = max(windowStart, cachedAt - METRIC_REFRESH_MINUTES*60)
+                    points = dict(points)
+                else:
+                    queryStart = windowStart
+                    points = {}
+                cache[key] = (windowStart, now, points)
+                # Aligning to the period keeps every run's data points on the same timestamps
+                queryStart -= queryStart % SECONDS_PER_DATA_POINT
+                queryId = "q"+str(len(queryKeys))
+                queryKeys[queryId] = key
+                queries.setdefault(queryStart, []).append(buildMetricQuery(queryId, metricName, dimensions))
+
+    paginator = CLOUDWATCH_CLIENT.get_paginator('get_metric_data')
+    for queryStart, windowQueries in queries.items():
+        for i in range(0, len(windowQueries), MAXIMUM_METRIC_QUERIES_PER_CALL):
+            # The paginator follows NextToken, results for one query can be split across pages
+            for page in paginator.paginate(MetricDataQueries=windowQueries[i:i+MAXIMUM_METRIC_QUERIES_PER_CALL],
+                    StartTime=queryStart, EndTime=now, ScanBy='TimestampDescending'):
+                for result in page["MetricDataResults"]:
+                    points = cache[queryKeys[result["Id"]]][2]
+                    # Refetched data points replace the possibly incomplete values cached for the same timestamp
+                    for timestamp, value in zip(result["Timestamps"], result["Values"]):
+                        points[timestamp.timestamp()] = value
+    # Aligned query starts can return a data point from before the window, one cutoff applies to cached and fetched points
+    for key, (windowStart, cachedAt, points) in cache.items():
+        cache[key] = (windowStart, cachedAt, {timestamp: value for timestamp, value in points.items() if timestamp >= windowStart})
+    # Only replace the cache once every fetch succeeded, tables that no longer exist drop out of it here
+    METRIC_CACHE.clear()
+    METRIC_CACHE.update(cache)
+    return {key: (max(points.values(), default=0)/SECONDS_PER_DATA_POINT, round((now - windowStart)/60))
+        for key, (windowStart, cachedAt, points) in cache.items()}
+
+def buildMetricQuery(queryId, metricName, dimensions):
+    return {'Id': queryId, 'MetricStat': {
+        'Metric': {'Namespace': 'AWS/DynamoDB', 'MetricName': metricName, 'Dimensions': dimensions},
+        'Period': SECONDS_PER_DATA_POINT, 'Stat': 'Sum'}}
+
+def adjustTable(table, peakThroughputs, notifications):
+    # Both adjustments add their changes to one UpdateTable request, a table can only process one update at a time
+    tableUpdate = {}
+    tableRecords = []
+    tableNotifications = []
+    adjustTableCapacity(table, peakThroughputs, tableUpdate, tableRecords, tableNotifications)
+    adjustTableIndexCapacities(table, peakThroughputs, tableUpdate, tableRecords, tableNotifications)
+    if tableUpdate:
+        DYNAMODB_CLIENT.update_table(TableName=table["TableName"], **tableUpdate)
+    # Only report changes once UpdateTable has accepted them
+    for record in tableRecords:
+        logger.info(json.dumps(record))
+    notifications.extend(tableNotifications)
+
+def adjustTableCapacity(table, peakThroughputs, tableUpdate, records, notifications):
+    tableName = table["TableName"]
+    currentCapacity = table["ProvisionedThroughput"]
     decreasesSoFarToday = currentCapacity["NumberOfDecreasesToday"]
     writeCapacity = currentCapacity["WriteCapacityUnits"]
     readCapacity = currentCapacity["ReadCapacityUnits"]
     
-    now = datetime.datetime.utcnow().isoformat()
-    start = ( datetime.datetime.utcnow() -
-        datetime.timedelta( minutes=1440 )
-        ).isoformat()
-
-    dimensions = [{'Name': 'TableName', 'Value': tableName}]
-    
-    writeThroughput = cloudwatch.get_metric_statistics(Period=SECONDS_PER_DATA_POINT,
-        StartTime=start, EndTime=now,   
-        MetricName='ConsumedWriteCapacityUnits', Namespace='AWS/DynamoDB',
-        Statistics=['Sum'],Dimensions=dimensions)
-    
-    readThroughput = cloudwatch.get_metric_statistics(Period=SECONDS_PER_DATA_POINT,
-        StartTime=start, EndTime=now,   
-        MetricName='ConsumedReadCapacityUnits', Namespace='AWS/DynamoDB',
-        Statistics=['Sum'],Dimensions=dimensions)
-    
-    peakReadThroughputLastDay = 0
-    peakWriteThroughputLastDay = 0
-    for datapoint in readThroughput["Datapoints"]:
-        peakReadThroughputLastDay = max(peakReadThroughputLastDay, datapoint["Sum"]/SECONDS_PER_DATA_POINT)
-        
-    for datapoint in writeThroughput["Datapoints"]:
-        peakWriteThroughputLastDay = max(peakWriteThroughputLastDay, datapoint["Sum"]/SECONDS_PER_DATA_POINT)        
-        
-    adjustedWriteCapacity = writeCapacity
-    adjustedReadCapacity = readCapacity
+    peakReadThroughput, peakWindowMinutes = peakThroughputs[(tableName, None, READ_METRIC)]
+    peakWriteThroughput, peakWindowMinutes = peakThroughputs[(tableName, None, WRITE_METRIC)]
         
-    if decreasesSoFarToday < MAXIMUM_TIMES_TO_LOWER_CAPACITY_PER_DAY:
-        adjustedWriteCapacity = math.ceil(peakWriteThroughputLastDay * LOWER_CAPACITY_MULTIPLE)
-        adjustedReadCapacity = math.ceil(peakReadThroughputLastDay * LOWER_CAPACITY_MULTIPLE)
-    
-    if peakWriteThroughputLastDay > (writeCapacity * RAISE_CAPACITY_THRESHOLD):
-        adjustedWriteCapacity = math.ceil(peakWriteThroughputLastDay * RAISE_CAPACITY_MULTIPLE)
-
-    if peakReadThroughputLastDay > (readCapacity * RAISE_CAPACITY_THRESHOLD):
-        adjustedReadCapacity = math.ceil(peakReadThroughputLastDay * RAISE_CAPACITY_MULTIPLE)
-    
-    adjustedWriteCapacity = max(adjustedWriteCapacity , MINIMUM_CAPACITY)
-    adjustedWriteCapacity = min(adjustedWriteCapacity , MAXIMUM_CAPACITY)
-    adjustedReadCapacity = max(adjustedReadCapacity , MINIMUM_CAPACITY)
-    adjustedReadCapacity = min(adjustedReadCapacity , MAXIMUM_CAPACITY)
+    canLower = decreasesSoFarToday < MAXIMUM_TIMES_TO_LOWER_CAPACITY_PER_DAY
+    adjustedWriteCapacity = planCapacity(peakWriteThroughput, writeCapacity, canLower)
+    adjustedReadCapacity = planCapacity(peakReadThroughput, readCapacity, canLower)
     
     readWasUpdated = (adjustedReadCapacity != readCapacity)
     writeWasUpdated = (adjustedWriteCapacity != writeCapacity)
         
     if readWasUpdated or writeWasUpdated:
-        dynamoClient = boto3.client('dynamodb')
-        dynamoClient.update_table(TableName=tableName, ProvisionedThroughput={
-            "ReadCapacityUnits": int(adjustedReadCapacity),
-            "WriteCapacityUnits": int(adjustedWriteCapacity)
-            })
+        tableUpdate["ProvisionedThroughput"] = {
+            "ReadCapacityUnits": adjustedReadCapacity,
+            "WriteCapacityUnits": adjustedWriteCapacity
+            }
     
-    returnString =  "Dynamo Table: "+tableName
-    returnString += " | Write Capacity: "+str(writeCapacity)
-    returnString += " | Read Capacity: "+str(readCapacity)
-    returnString += " | Decreases So Far Today: "+str(decreasesSoFarToday)+"/"+str(MAXIMUM_TIMES_TO_LOWER_CAPACITY_PER_DAY)+""
-    returnString += " | Peak Read Capacity (24hrs): "+str(peakReadThroughputLastDay)
-    returnString += " | Peak Write Capacity (24hrs): "+str(peakWriteThroughputLastDay)
-    returnString += " | Updated Read: "+str(readWasUpdated)
-    returnString += " | New Read Capacity: "+str(adjustedReadCapacity)
-    returnString += " | Updated Write: "+str(writeWasUpdated)
-    returnString += " | New Write Capacity: "+str(adjustedWriteCapacity)
+    records.append({
+        "table": tableName,
+        "writeCapacity": writeCapacity,
+        "readCapacity": readCapacity,
+        "decreasesSoFarToday": decreasesSoFarToday,
+        "peakRead": peakReadThroughput,
+        "peakWrite": peakWriteThroughput,
+        "peakWindowMinutes": peakWindowMinutes,
+        "updatedRead": readWasUpdated,
+        "newReadCapacity": adjustedReadCapacity,
+        "updatedWrite": writeWasUpdated,
+        "newWriteCapacity": adjustedWriteCapacity
+        })
     if (readWasUpdated == True or writeWasUpdated == True) and len(EMAIL_ADDRESSES_OF_RECIPIENTS) > 0 and EMAIL_ADDRESS_OF_SENDER != "":
-        sendEmailNotification("Dynamo Capacity Updated For Table "+tableName+"","Details: "+returnString)
-    print(returnString)
+        returnString = " | ".join([
+            f"Dynamo Table: {tableName}",
+            f"Write Capacity: {writeCapacity}",
+            f"Read Capacity: {readCapacity}",
+            f"Decreases So Far Today: {decreasesSoFarToday}/{MAXIMUM_TIMES_TO_LOWER_CAPACITY_PER_DAY}",
+            f"Peak Read Capacity (last {peakWindowMinutes} mins): {peakReadThroughput}",
+            f"Peak Write Capacity (last {peakWindowMinutes} mins): {peakWriteThroughput}",
+            f"Updated Read: {readWasUpdated}",
+            f"New Read Capacity: {adjustedReadCapacity}",
+            f"Updated Write: {writeWasUpdated}",
+            f"New Write Capacity: {adjustedWriteCapacity}"
+            ])
+        notifications.append(returnString)
     
-def adjustTableIndexCapacities(tableName):
-    dynamodb = boto3.resource('dynamodb').Table(tableName)
-    if dynamodb.global_secondary_indexes is None:
-        print("No secondary indexes in table: "+tableName)
+def adjustTableIndexCapacities(table, peakThroughputs, tableUpdate, records, notifications):
+    tableName = table["TableName"]
+    if table.get("GlobalSecondaryIndexes") is None:
+        logger.info(json.dumps({"table": tableName, "message": "No secondary indexes"}))
         return
-
-    cloudwatch = boto3.client('cloudwatch')
     
-    for secondaryIndex in dynamodb.global_secondary_indexes:
+    for secondaryIndex in table["GlobalSecondaryIndexes"]:
         secondaryIndexName = secondaryIndex["IndexName"]
         currentCapacity = secondaryIndex["ProvisionedThroughput"]
         decreasesSoFarToday = currentCapacity["NumberOfDecreasesToday"]
         writeCapacity = currentCapacity["WriteCapacityUnits"]
         readCapacity = currentCapacity["ReadCapacityUnits"]
         
-        now = datetime.datetime.utcnow().isoformat()
-        start = ( datetime.datetime.utcnow() -
-            datetime.timedelta( minutes=1440 )
-            ).isoformat()
+        peakReadThroughput, peakWindowMinutes = peakThroughputs[(tableName, secondaryIndexName, READ_METRIC)]
+        peakWriteThroughput, peakWindowMinutes = peakThroughputs[(tableName, secondaryIndexName, WRITE_METRIC)]
 
-        dimensions = [{'Name': 'TableName', 'Value': tableName}, {'Name': 'GlobalSecondaryIndexName', 'Value': secondaryIndexName}]
-        
-        writeThroughput = cloudwatch.get_metric_statistics(Period=SECONDS_PER_DATA_POINT,
-            StartTime=start, EndTime=now,   
-            MetricName='ConsumedWriteCapacityUnits', Namespace='AWS/DynamoDB',
-            Statistics=['Sum'],Dimensions=dimensions)
-        
-        readThroughput = cloudwatch.get_metric_statistics(Period=SECONDS_PER_DATA_POINT,
-            StartTime=start, EndTime=now,   
-            MetricName='ConsumedReadCapacityUnits', Namespace='AWS/DynamoDB',
-            Statistics=['Sum'],Dimensions=dimensions)
-            
-        peakReadThroughputLastDay = 0
-        peakWriteThroughputLastDay = 0
-        for datapoint in readThroughput["Datapoints"]:
-            peakReadThroughputLastDay = max(peakReadThroughputLastDay, datapoint["Sum"]/SECONDS_PER_DATA_POINT)
-            
-        for datapoint in writeThroughput["Datapoints"]:
-            peakWriteThroughputLastDay = max(peakWriteThroughputLastDay, datapoint["Sum"]/SECONDS_PER_DATA_POINT)
-
-
-        adjustedWriteCapacity = writeCapacity
-        adjustedReadCapacity = readCapacity
-            
-        if decreasesSoFarToday < MAXIMUM_TIMES_TO_LOWER_CAPACITY_PER_DAY:
-            adjustedWriteCapacity = math.ceil(peakWriteThroughputLastDay * LOWER_CAPACITY_MULTIPLE)
-            adjustedReadCapacity = math.ceil(peakReadThroughputLastDay * LOWER_CAPACITY_MULTIPLE)
-        
-        if peakWriteThroughputLastDay > (writeCapacity * RAISE_CAPACITY_THRESHOLD):
-            adjustedWriteCapacity = math.ceil(peakWriteThroughputLastDay * RAISE_CAPACITY_MULTIPLE)
-
-        if peakReadThroughputLastDay > (readCapacity * RAISE_CAPACITY_THRESHOLD):
-            adjustedReadCapacity = math.ceil(peakReadThroughputLastDay * RAISE_CAPACITY_MULTIPLE)
-        
-        adjustedWriteCapacity = max(adjustedWriteCapacity , MINIMUM_CAPACITY)
-        adjustedWriteCapacity = min(adjustedWriteCapacity , MAXIMUM_CAPACITY)
-        adjustedReadCapacity = max(adjustedReadCapacity , MINIMUM_CAPACITY)
-        adjustedReadCapacity = min(adjustedReadCapacity , MAXIMUM_CAPACITY)
+        canLower = decreasesSoFarToday < MAXIMUM_TIMES_TO_LOWER_CAPACITY_PER_DAY
+        adjustedWriteCapacity = planCapacity(peakWriteThroughput, writeCapacity, canLower)
+        adjustedReadCapacity = planCapacity(peakReadThroughput, readCapacity, canLower)
         
         readWasUpdated = (adjustedReadCapacity != readCapacity)
         writeWasUpdated = (adjustedWriteCapacity != writeCapacity)
             
         if readWasUpdated or writeWasUpdated:
-            dynamoClient = boto3.client('dynamodb')
-            dynamoClient.update_table(TableName=tableName, GlobalSecondaryIndexUpdates=[
+            tableUpdate.setdefault("GlobalSecondaryIndexUpdates", []).append(
                 {"Update":
                     {"IndexName": secondaryIndexName,
                         "ProvisionedThroughput":
                         {
-                            "ReadCapacityUnits": int(adjustedReadCapacity),
-                            "WriteCapacityUnits": int(adjustedWriteCapacity)
+                            "ReadCapacityUnits": adjustedReadCapacity,
+                            "WriteCapacityUnits": adjustedWriteCapacity
                         }
                     }
                 }
-            ])
+            )
         
-        returnString = "Dynamo Table ("+tableName+") Index: "+secondaryIndexName
-        returnString += " | Write Capacity: "+str(writeCapacity)
-        returnString += " | Read Capacity: "+str(readCapacity)
-        returnString += " | Decreases So Far Today: "+str(decreasesSoFarToday)+"/"+str(MAXIMUM_TIMES_TO_LOWER_CAPACITY_PER_DAY)+""
-        returnString += " | Peak Read Capacity (24hrs): "+str(peakReadThroughputLastDay)
-        returnString += " | Peak Write Capacity (24hrs): "+str(peakWriteThroughputLastDay)
-        returnString += " | Updated Read: "+str(readWasUpdated)
-        returnString += " | New Read Capacity: "+str(adjustedReadCapacity)
-        returnString += " | Updated Write: "+str(writeWasUpdated)
-        returnString += " | New Write Capacity: "+str(adjustedWriteCapacity)
+        records.append({
+            "table": tableName,
+            "index": secondaryIndexName,
+            "writeCapacity": writeCapacity,
+            "readCapacity": readCapacity,
+            "decreasesSoFarToday": decreasesSoFarToday,
+            "peakRead": peakReadThroughput,
+            "peakWrite": peakWriteThroughput,
+            "peakWindowMinutes": peakWindowMinutes,
+            "updatedRead": readWasUpdated,
+            "newReadCapacity": adjustedReadCapacity,
+            "updatedWrite": writeWasUpdated,
+            "newWriteCapacity": adjustedWriteCapacity
+            })
         if (readWasUpdated == True or writeWasUpdated == True) and len(EMAIL_ADDRESSES_OF_RECIPIENTS) > 0 and EMAIL_ADDRESS_OF_SENDER != "":
-            sendEmailNotification("Dynamo Capacity Updated For Index "+secondaryIndexName+" on Table "+tableName+"","Details: "+returnString)
-        print(returnString)
-    print("Finished Secondary Indexes on Table: "+tableName)
+            returnString = " | ".join([
+                f"Dynamo Table ({tableName}) Index: {secondaryIndexName}",
+                f"Write Capacity: {writeCapacity}",
+                f"Read Capacity: {readCapacity}",
+                f"Decreases So Far Today: {decreasesSoFarToday}/{MAXIMUM_TIMES_TO_LOWER_CAPACITY_PER_DAY}",
+                f"Peak Read Capacity (last {peakWindowMinutes} mins): {peakReadThroughput}",
+                f"Peak Write Capacity (last {peakWindowMinutes} mins): {peakWriteThroughput}",
+                f"Updated Read: {readWasUpdated}",
+                f"New Read Capacity: {adjustedReadCapacity}",
+                f"Updated Write: {writeWasUpdated}",
+                f"New Write Capacity: {adjustedWriteCapacity}"
+                ])
+            notifications.append(returnString)
+    logger.info(json.dumps({"table": tableName, "message": "Finished secondary indexes"}))
+
+
+def isSettledAtMinimum(currentCapacity):
+    # With no decreases left today and both capacities at the minimum only a raise is possible
+    return (currentCapacity["NumberOfDecreasesToday"] >= MAXIMUM_TIMES_TO_LOWER_CAPACITY_PER_DAY
+        and currentCapacity["ReadCapacityUnits"] <= MINIMUM_CAPACITY
+        and currentCapacity["WriteCapacityUnits"] <= MINIMUM_CAPACITY)
 
+def planCapacity(peakThroughput, capacity, canLower):
+    # Raising wins over lowering, either way the result is clamped to the configured limits
+    if peakThroughput > capacity * RAISE_CAPACITY_THRESHOLD:
+        capacity = math.ceil(peakThroughput * RAISE_CAPACITY_MULTIPLE)
+    elif canLower:
+        capacity = math.ceil(peakThroughput * LOWER_CAPACITY_MULTIPLE)
+    return min(max(capacity, MINIMUM_CAPACITY), MAXIMUM_CAPACITY)
         
 def sendEmailNotification(subject, body):
-    ses = boto3.client('ses')
-    ses.send_email(
+    global SES_CLIENT
+    if SES_CLIENT is None:
+        SES_CLIENT = boto3.client('ses', config=BOTO_CONFIG)
+    SES_CLIENT.send_email(
         Source=EMAIL_ADDRESS_OF_SENDER,
         Destination={
             'ToAddresses': EMAIL_ADDRESSES_OF_RECIPIENTS